@@ -1,31 +1,167 @@
 import cv2
 import numpy as np
 import torch
+import torch.nn.functional as F
+import torchvision
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Callable
 import logging
-from datetime import datetime
+import copy
+import time
 import os
+import subprocess
+import threading
+from collections import deque
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def non_max_suppression(pred: torch.Tensor, conf_thres: float = 0.25, iou_thres: float = 0.45,
+                        max_det: int = 1000) -> List[torch.Tensor]:
+    """
+    Class-aware NMS over raw YOLOv5 output, matching AutoShape's defaults.
+    
+    Args:
+        pred: Raw predictions of shape (B, N, 5 + num_classes) in xywh format
+        
+    Returns:
+        One (M, 6) tensor of [x1, y1, x2, y2, conf, cls] rows per image
+    """
+    output = []
+    for x in pred.float():
+        x = x[x[:, 4] > conf_thres]  # objectness
+        conf, cls = (x[:, 5:] * x[:, 4:5]).max(1)
+        keep = conf > conf_thres
+        x, conf, cls = x[keep], conf[keep], cls[keep]
+        
+        # xywh -> xyxy
+        boxes = torch.cat((x[:, :2] - x[:, 2:4] / 2, x[:, :2] + x[:, 2:4] / 2), 1)
+        idx = torchvision.ops.batched_nms(boxes, conf, cls, iou_thres)[:max_det]
+        output.append(torch.cat((boxes[idx], conf[idx, None], cls[idx, None].float()), 1))
+    return output
+
+def count_detections(detections: Dict[str, np.ndarray]) -> int:
+    """Number of entries in a struct-of-arrays detection buffer."""
+    return len(detections['conf'])
+
+class TensorRTEngine:
+    """Thin runner around a serialized TensorRT engine with preallocated device buffers."""
+    
+    def __init__(self, engine_path: str, max_batch_size: int = 8, device: str = 'cuda'):
+        try:
+            import tensorrt as trt
+        except ImportError as e:
+            raise RuntimeError("TensorRT backend requested but the tensorrt package is not installed") from e
+        
+        with open(engine_path, 'rb') as f, trt.Runtime(trt.Logger(trt.Logger.WARNING)) as runtime:
+            self.engine = runtime.deserialize_cuda_engine(f.read())
+        self.context = self.engine.create_execution_context()
+        
+        # Bindings are sized for the largest batch in the optimization profile
+        in_shape = tuple(self.engine.get_tensor_shape('images'))[1:]
+        self.context.set_input_shape('images', (max_batch_size, *in_shape))
+        out_shape = tuple(self.context.get_tensor_shape('output'))
+        self._input = torch.empty((max_batch_size, *in_shape), dtype=torch.float32, device=device)
+        self._output = torch.empty(out_shape, dtype=torch.float32, device=device)
+        self.context.set_tensor_address('images', self._input.data_ptr())
+        self.context.set_tensor_address('output', self._output.data_ptr())
+        self.max_batch_size = max_batch_size
+    
+    def __call__(self, images: torch.Tensor) -> torch.Tensor:
+        b = images.shape[0]
+        if b > self.max_batch_size:
+            return torch.cat([self(chunk) for chunk in images.split(self.max_batch_size)])
+        
+        self._input[:b].copy_(images, non_blocking=True)
+        self.context.set_input_shape('images', tuple(self._input[:b].shape))
+        self.context.execute_async_v3(torch.cuda.current_stream().cuda_stream)
+        return self._output[:b].clone()
+
+class OpenVINOModel:
+    """Thin runner around a compiled OpenVINO model on the CPU."""
+    
+    def __init__(self, model_path: str, device: str = 'cpu', ov_device: str = 'CPU'):
+        try:
+            from openvino.runtime import Core
+        except ImportError as e:
+            raise RuntimeError("OpenVINO backend requested but the openvino package is not installed") from e
+        
+        # Batches run as one synchronous request; LATENCY gives that request every core,
+        # whereas THROUGHPUT would split them across streams that only parallel requests use
+        self.compiled = Core().compile_model(model_path, ov_device, config={'PERFORMANCE_HINT': 'LATENCY'})
+        self.request = self.compiled.create_infer_request()
+        self.output = self.compiled.output(0)
+        self.device = device
+    
+    def __call__(self, images: torch.Tensor) -> torch.Tensor:
+        result = self.request.infer({0: images.cpu().numpy()})
+        return torch.from_numpy(result[self.output]).to(self.device)
+
+class CUDAGraphRunner:
+    """Replays captured CUDA graphs of a forward pass, one graph per input shape."""
+    
+    def __init__(self, forward: Callable, warmup_iters: int = 3):
+        self.forward = forward
+        self.warmup_iters = warmup_iters
+        self._graphs = {}  # input shape -> (graph, static input, static output)
+    
+    def __call__(self, images: torch.Tensor):
+        entry = self._graphs.get(images.shape)
+        if entry is None:
+            entry = self._graphs[images.shape] = self._capture(images)
+        
+        graph, static_in, static_out = entry
+        static_in.copy_(images)
+        graph.replay()
+        return static_out  # overwritten by the next replay
+    
+    def _capture(self, images: torch.Tensor) -> Tuple:
+        static_in = images.clone()
+        
+        # Warm up on a side stream so lazy initialization is not recorded in the graph
+        side = torch.cuda.Stream()
+        side.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(side):
+            for _ in range(self.warmup_iters):
+                self.forward(static_in)
+        torch.cuda.current_stream().wait_stream(side)
+        
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph):
+            static_out = self.forward(static_in)
+        return graph, static_in, static_out
+
 class ViolationDetector:
-    def __init__(self, model_path: str = None, device: str = None):
+    def __init__(self, model_path: str = None, device: str = None, backend: str = None,
+                 img_size: int = 640, engine_path: str = None, cuda_graphs: bool = None,
+                 half: bool = None):
         """
         Initialize the violation detector with YOLOv5 model.
         
         Args:
             model_path: Path to the YOLOv5 model weights
             device: Device to run inference on ('cuda' or 'cpu')
+            backend: Inference backend ('eager', 'torchscript', 'compile', 'tensorrt' or 'openvino'),
+                defaults to $DETECTOR_BACKEND
+            img_size: Fixed square input size used by the accelerated backends
+            engine_path: TensorRT engine file, built on first use if missing
+            cuda_graphs: Capture and replay the forward pass as a CUDA graph,
+                defaults to $DETECTOR_CUDA_GRAPHS
+            half: Run the PyTorch network in FP16 on CUDA, defaults to $DETECTOR_HALF
         """
         self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
         logger.info(f"Using device: {self.device}")
         
-        # Load YOLOv5 model
+        # Load YOLOv5 model, preferring a local checkout and weights over the hub download
+        model_path = model_path or os.environ.get('DETECTOR_WEIGHTS', 'models/yolov5s.pt')
+        local_repo = os.environ.get('YOLOV5_REPO', 'models/yolov5')
         try:
-            self.model = torch.hub.load('ultralytics/yolov5', 'yolov5s', pretrained=True)
+            if Path(local_repo).is_dir() and Path(model_path).is_file():
+                self.model = torch.hub.load(local_repo, 'custom', path=model_path, source='local')
+            else:
+                logger.info(f"No local YOLOv5 repo/weights at {local_repo} / {model_path}, loading from torch hub")
+                self.model = torch.hub.load('ultralytics/yolov5', 'yolov5s', pretrained=True)
             self.model.to(self.device)
             self.model.eval()
             logger.info("YOLOv5 model loaded successfully")
@@ -42,130 +178,433 @@ class ViolationDetector:
         self.helmet_model = None  # Placeholder for helmet detection model
         self.seatbelt_model = None  # Placeholder for seatbelt detection model
         
-    def detect_vehicles(self, frame: np.ndarray) -> List[Dict]:
+        # Cached generator for the placeholder checks (SFC64 is the cheapest bit generator)
+        self._rng = np.random.Generator(np.random.SFC64())
+        
+        # Detection may be driven from several threads (stream loop, API batcher)
+        self._lock = threading.Lock()
+        
+        # Pinned staging buffer and side stream for async host-to-device frame uploads
+        self._staging = None
+        self._copy_stream = torch.cuda.Stream() if self.device.startswith('cuda') else None
+        self._copy_done = torch.cuda.Event() if self.device.startswith('cuda') else None
+        
+        # Optional accelerated forward pass; when set, AutoShape pre/post-processing is bypassed
+        self.img_size = img_size
+        self.backend = backend or os.environ.get('DETECTOR_BACKEND', 'eager')
+        
+        # FP16 weights and activations on CUDA; skipped on CPU, where it is slower, and for
+        # TensorRT/OpenVINO, whose models are already compressed to FP16 and take float32 input
+        if half is None:
+            half = os.environ.get('DETECTOR_HALF', '1') == '1'
+        self.half = half and self.device.startswith('cuda') and self.backend not in ('tensorrt', 'openvino')
+        self._input_dtype = torch.float16 if self.half else torch.float32
+        if self.half:
+            self.model.half()  # AutoShape casts its input to the weight dtype
+            logger.info("Running detector in FP16")
+        
+        self._forward = None
+        if self.backend == 'torchscript':
+            self._forward = self._build_torchscript()
+        elif self.backend == 'compile':
+            self._forward = self._build_compiled()
+        elif self.backend == 'tensorrt':
+            self._forward = self._build_tensorrt(engine_path or os.environ.get('DETECTOR_ENGINE', 'models/yolov5s.engine'))
+        elif self.backend == 'openvino':
+            self._forward = self._build_openvino(os.environ.get('DETECTOR_OPENVINO_MODEL', 'models/yolov5s_openvino.xml'))
+        elif self.backend != 'eager':
+            raise ValueError(f"Unknown detector backend: {self.backend}")
+        logger.info(f"Using inference backend: {self.backend}")
+        
+        if cuda_graphs is None:
+            cuda_graphs = os.environ.get('DETECTOR_CUDA_GRAPHS', '0') == '1'
+        if cuda_graphs:
+            self._enable_cuda_graphs()
+    
+    def _raw_network(self) -> torch.nn.Module:
+        """Return the bare YOLOv5 network wrapped by AutoShape."""
+        net = self.model.model
+        if hasattr(net, 'pt'):  # DetectMultiBackend wrapper in recent YOLOv5 releases
+            net = net.model
+        return (net.half() if self.half else net.float()).eval()
+    
+    def _build_torchscript(self) -> torch.jit.ScriptModule:
+        """Trace, freeze and optimize the network for inference."""
+        net = self._raw_network()
+        dummy = torch.zeros(1, 3, self.img_size, self.img_size, dtype=self._input_dtype, device=self.device)
+        
+        # YOLOv5's forward is not scriptable, so trace it at the fixed input shape
+        with torch.no_grad():
+            traced = torch.jit.trace(net, dummy, strict=False)
+        frozen = torch.jit.freeze(traced.eval())
+        return torch.jit.optimize_for_inference(frozen)
+    
+    def _build_compiled(self) -> Callable:
+        """Compile the network with TorchInductor for repeated fixed-shape calls."""
+        # Inputs are always letterboxed to img_size, so a static graph never recompiles on frame size
+        return torch.compile(self._raw_network(), mode="reduce-overhead", fullgraph=False, dynamic=False)
+    
+    def _build_tensorrt(self, engine_path: str) -> TensorRTEngine:
+        """Load (building if needed) an FP16 TensorRT engine for the network."""
+        if not self.device.startswith('cuda'):
+            raise ValueError("TensorRT backend requires a CUDA device")
+        if not os.path.exists(engine_path):
+            self.export_engine(engine_path=engine_path)
+        return TensorRTEngine(engine_path, device=self.device)
+    
+    def _build_openvino(self, model_path: str) -> 'OpenVINOModel':
+        """Load (converting if needed) an FP16-compressed OpenVINO model for the network."""
+        if not os.path.exists(model_path):
+            self.export_openvino(model_path=model_path)
+        return OpenVINOModel(model_path, device=self.device)
+    
+    def _enable_cuda_graphs(self):
+        """Wrap the fixed-shape forward pass in a CUDA graph replayer."""
+        if not self.device.startswith('cuda'):
+            logger.warning("CUDA graphs requested on a non-CUDA device; ignoring")
+            return
+        if self.backend in ('compile', 'tensorrt', 'openvino'):
+            # reduce-overhead compile already uses CUDA graphs; TensorRT and OpenVINO have their own runtimes
+            logger.warning(f"CUDA graphs are not applied on top of the {self.backend} backend")
+            return
+        
+        self._forward = CUDAGraphRunner(self._forward or self._raw_network())
+        logger.info("CUDA graph capture enabled for detector forward pass")
+    
+    def export_onnx(self, onnx_path: str) -> str:
+        """
+        Export the network to ONNX with a dynamic batch axis ('images' -> 'output').
+        
+        Returns:
+            Path to the ONNX file
+        """
+        Path(onnx_path).parent.mkdir(parents=True, exist_ok=True)
+        
+        # Exported runtimes take float32 input; export from a float copy so an FP16 model is left untouched
+        net = copy.deepcopy(self._raw_network()).float()
+        dummy = torch.zeros(1, 3, self.img_size, self.img_size, device=self.device)
+        detect_layers = [m for m in net.modules() if hasattr(m, 'export')]
+        try:
+            # Export mode makes the Detect head return only the concatenated predictions
+            for m in detect_layers:
+                m.export = True
+            torch.onnx.export(
+                net, dummy, onnx_path, opset_version=17,
+                input_names=['images'], output_names=['output'],
+                dynamic_axes={'images': {0: 'batch'}, 'output': {0: 'batch'}}
+            )
+        finally:
+            for m in detect_layers:
+                m.export = False
+        logger.info(f"Exported ONNX model to {onnx_path}")
+        return onnx_path
+    
+    def export_engine(self, onnx_path: str = None, engine_path: str = 'models/yolov5s.engine',
+                      max_batch_size: int = 8) -> str:
+        """
+        Export the network to ONNX and build an FP16 TensorRT engine with trtexec.
+        
+        INT8 is deliberately not offered: it needs a representative calibration set.
+        
+        Returns:
+            Path to the serialized engine
+        """
+        onnx_path = self.export_onnx(onnx_path or str(Path(engine_path).with_suffix('.onnx')))
+        
+        shape = f"3x{self.img_size}x{self.img_size}"
+        subprocess.run([
+            'trtexec', f'--onnx={onnx_path}', '--fp16', f'--saveEngine={engine_path}',
+            f'--minShapes=images:1x{shape}',
+            f'--optShapes=images:{max_batch_size}x{shape}',
+            f'--maxShapes=images:{max_batch_size}x{shape}'
+        ], check=True)
+        logger.info(f"Built TensorRT engine at {engine_path}")
+        return engine_path
+    
+    def export_openvino(self, onnx_path: str = None, model_path: str = 'models/yolov5s_openvino.xml') -> str:
+        """
+        Export the network to ONNX and convert it to an OpenVINO IR with FP16-compressed weights.
+        
+        INT8 (POT/NNCF quantization) is deliberately not offered: it needs a representative
+        calibration set of traffic frames.
+        
+        Returns:
+            Path to the IR .xml file
+        """
+        try:
+            from openvino.runtime import serialize
+            from openvino.tools.mo import convert_model
+        except ImportError as e:
+            raise RuntimeError("OpenVINO export requested but the openvino package is not installed") from e
+        
+        onnx_path = self.export_onnx(onnx_path or str(Path(model_path).with_suffix('.onnx')))
+        serialize(convert_model(onnx_path, compress_to_fp16=True), model_path)
+        logger.info(f"Built OpenVINO model at {model_path}")
+        return model_path
+    
+    def warmup(self, max_batch_size: int = 1):
+        """
+        Run dummy forward passes so one-off JIT/compile costs are paid before real traffic.
+        
+        Static-shape backends (compile, CUDA graphs) specialize on the batch size, so
+        every size up to max_batch_size is run once.
+        
+        Args:
+            max_batch_size: Largest batch size the callers will submit
+        """
+        if self._forward is None:
+            return
+        
+        frame = np.zeros((self.img_size, self.img_size, 3), dtype=np.uint8)
+        for batch_size in range(1, max_batch_size + 1):
+            for _ in range(2):  # the profiling executor optimizes on the second run
+                self.detect_batch([frame] * batch_size)
+        
+    def detect_all(self, frame: np.ndarray) -> Tuple[Dict[str, np.ndarray], Dict]:
         """
-        Detect vehicles in the frame.
+        Detect vehicles and traffic violations with a single forward pass.
         
         Args:
             frame: Input BGR image
             
         Returns:
-            List of detected vehicles with their properties
+            Struct-of-arrays vehicle buffer and dictionary of violation buffers by type
         """
-        # Run inference
-        results = self.model(frame)
-        
-        # Filter vehicle detections
-        detections = []
-        for *xyxy, conf, cls in results.xyxy[0]:
-            if int(cls) in self.vehicle_classes:
-                x1, y1, x2, y2 = map(int, xyxy)
-                detections.append({
-                    'class_id': int(cls),
-                    'class_name': self.class_names[int(cls)],
-                    'bbox': [x1, y1, x2, y2],
-                    'confidence': float(conf),
-                    'track_id': None  # Will be used for tracking
-                })
-                
-        return detections
-    
-    def detect_violations(self, frame: np.ndarray) -> Dict:
+        return self.detect_all_batch([frame])[0]
+    
+    def detect_all_batch(self, frames: List[np.ndarray],
+                         resized: Optional[List[Tuple[np.ndarray, float]]] = None) -> List[Tuple[Dict[str, np.ndarray], Dict]]:
         """
-        Detect traffic violations in the frame.
+        Run detect_all() over several frames with one batched forward pass.
         
         Args:
-            frame: Input BGR image
+            frames: Full-resolution input BGR images
+            resized: Optional (image, scale) per frame from resize_to_input(); the network
+                runs on these and the boxes are scaled back to the full-resolution frames
             
         Returns:
-            Dictionary containing detected violations
+            One (vehicles, violations) pair per frame, in full-resolution coordinates
         """
-        violations = {
-            'no_helmet': [],
-            'no_seatbelt': [],
-            'triple_riding': [],
-            'wrong_way': []
-        }
+        if resized is None:
+            inputs, scales = frames, [1.0] * len(frames)
+        else:
+            inputs, scales = [img for img, _ in resized], [scale for _, scale in resized]
         
-        # Run object detection
-        results = self.model(frame)
+        results = []
+        for frame, bboxes, scale in zip(frames, self.detect_batch(inputs), scales):
+            columns = self._split_detections(bboxes, scale)
+            results.append((self._vehicles_from_detections(*columns),
+                            self._violations_from_detections(frame, *columns)))
+        return results
+    
+    def resize_to_input(self, frame: np.ndarray) -> Tuple[np.ndarray, float]:
+        """
+        Downscale a frame once so its longer side matches the network input size.
         
-        # Get detections
-        bboxes = results.xyxy[0].cpu().numpy()
+        Returns:
+            Resized image (the frame itself if already small enough) and the factor
+            that maps its coordinates back to the original frame
+        """
+        h, w = frame.shape[:2]
+        ratio = self.img_size / max(h, w)
+        if ratio >= 1:
+            return frame, 1.0
+        new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+        return cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_AREA), w / new_w
+    
+    def detect_batch(self, frames: List[np.ndarray], size: int = None) -> List[np.ndarray]:
+        """
+        Run a single batched forward pass over several frames.
         
-        # Process detections for violations
-        for *xyxy, conf, cls in bboxes:
-            x1, y1, x2, y2 = map(int, xyxy)
-            class_id = int(cls)
+        Args:
+            frames: List of input BGR images (may differ in resolution)
+            size: Inference size, defaults to img_size
             
-            # Detect no-helmet and triple riding for motorcycles
-            if class_id == 3:  # Motorcycle
-                # Get all persons in the vicinity of the motorcycle
-                riders = self._find_riders(bboxes, [x1, y1, x2, y2])
-                
-                # Check for no-helmet
-                for rider in riders:
-                    if not self._is_wearing_helmet(frame, rider['bbox']):
-                        violations['no_helmet'].append({
-                            'bbox': rider['bbox'],
-                            'confidence': rider['confidence'],
-                            'vehicle_bbox': [x1, y1, x2, y2]
-                        })
-                
-                # Check for triple riding
-                if len(riders) >= 3:
-                    violations['triple_riding'].append({
-                        'bbox': [x1, y1, x2, y2],
-                        'confidence': float(conf),
-                        'rider_count': len(riders)
-                    })
+        Returns:
+            One (N, 6) array of [x1, y1, x2, y2, conf, cls] rows per frame
+        """
+        if not frames:
+            return []
+        
+        with self._lock:
+            if self._forward is None:
+                results = self.model(list(frames), size=size or self.img_size)
+                return [det.cpu().numpy() for det in results.xyxy]
             
-            # Detect no-seatbelt for cars
-            elif class_id == 2:  # Car
-                if not self._is_wearing_seatbelt(frame, [x1, y1, x2, y2]):
-                    violations['no_seatbelt'].append({
-                        'bbox': [x1, y1, x2, y2],
-                        'confidence': float(conf)
-                    })
+            batch, meta = self._preprocess(frames)
+            with torch.inference_mode(), torch.jit.optimized_execution(True):
+                pred = self._forward(batch)
+                if isinstance(pred, (list, tuple)):  # eval-mode Detect also returns feature maps
+                    pred = pred[0]
+                return self._postprocess(pred.float(), meta)
+    
+    def _upload(self, frames: List[np.ndarray]) -> List[torch.Tensor]:
+        """
+        Move uint8 frames to the inference device.
+        
+        On CUDA the frames are packed into a persistent pinned buffer and copied
+        with one non-blocking transfer on a side stream; the default stream waits
+        on it, so the upload can overlap with work already queued there.
+        """
+        if self._copy_stream is None:
+            return [torch.from_numpy(np.ascontiguousarray(frame)).to(self.device) for frame in frames]
+        
+        total = sum(frame.size for frame in frames)
+        self._copy_done.synchronize()  # the previous upload must finish before the buffer is reused
+        if self._staging is None or self._staging.numel() < total:
+            self._staging = torch.empty(total, dtype=torch.uint8, pin_memory=True)
+        
+        staging = self._staging.numpy()
+        offset = 0
+        for frame in frames:
+            np.copyto(staging[offset:offset + frame.size].reshape(frame.shape), frame)
+            offset += frame.size
+        
+        with torch.cuda.stream(self._copy_stream):
+            device_buf = self._staging[:total].to(self.device, non_blocking=True)
+            self._copy_done.record()
+        compute_stream = torch.cuda.current_stream()
+        compute_stream.wait_stream(self._copy_stream)
+        device_buf.record_stream(compute_stream)
+        
+        uploaded, offset = [], 0
+        for frame in frames:
+            uploaded.append(device_buf[offset:offset + frame.size].view(frame.shape))
+            offset += frame.size
+        return uploaded
+    
+    def _preprocess(self, frames: List[np.ndarray]) -> Tuple[torch.Tensor, List[Tuple]]:
+        """
+        Letterbox frames to img_size and build a normalized BCHW tensor.
+        
+        Frames are uploaded once as uint8 and every later step (layout change,
+        normalization, resize, padding) runs on the inference device.
+        """
+        size = self.img_size
+        batch = torch.full((len(frames), 3, size, size), 114 / 255, dtype=self._input_dtype, device=self.device)
+        meta = []
+        for i, img in enumerate(self._upload(frames)):
+            h, w = img.shape[:2]
+            ratio = min(size / h, size / w)
+            new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+            left, top = (size - new_w) // 2, (size - new_h) // 2
             
-            # Check for wrong-way driving (simplified - would need additional logic)
-            # This is a placeholder - actual implementation would require tracking
-            # and analyzing vehicle direction against road direction
+            img = img.permute(2, 0, 1).unsqueeze(0).to(self._input_dtype).div_(255)
+            if (new_h, new_w) != (h, w):
+                img = F.interpolate(img, size=(new_h, new_w), mode='bilinear', align_corners=False)
+            batch[i, :, top:top + new_h, left:left + new_w] = img[0]
+            meta.append((ratio, (left, top), (h, w)))
+        return batch, meta
+    
+    def _postprocess(self, pred: torch.Tensor, meta: List[Tuple]) -> List[np.ndarray]:
+        """Run NMS and map boxes back to original frame coordinates."""
+        outputs = []
+        for det, (ratio, (left, top), (h, w)) in zip(non_max_suppression(pred), meta):
+            det[:, [0, 2]] = ((det[:, [0, 2]] - left) / ratio).clamp(0, w)
+            det[:, [1, 3]] = ((det[:, [1, 3]] - top) / ratio).clamp(0, h)
+            outputs.append(det.cpu().numpy())
+        return outputs
+    
+    @staticmethod
+    def _split_detections(bboxes: np.ndarray, scale: float = 1.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Split raw (N, 6) detections once into int32 boxes (scaled by scale), float32 scores and int32 classes."""
+        boxes = bboxes[:, :4] if scale == 1.0 else bboxes[:, :4].astype(np.float32) * scale
+        return (boxes.astype(np.int32),
+                bboxes[:, 4].astype(np.float32),
+                bboxes[:, 5].astype(np.int32))
+    
+    def _vehicles_from_detections(self, xyxy: np.ndarray, conf: np.ndarray, cls: np.ndarray) -> Dict[str, np.ndarray]:
+        """Filter split detections down to a struct-of-arrays buffer of vehicles."""
+        keep = np.isin(cls, self.vehicle_classes)
+        return {
+            'xyxy': xyxy[keep],
+            'conf': conf[keep],
+            'cls': cls[keep],
+            'track_id': np.full(int(keep.sum()), -1, dtype=np.int32)  # Will be used for tracking
+        }
+    
+    def _violations_from_detections(self, frame: np.ndarray, xyxy: np.ndarray, conf: np.ndarray,
+                                    cls: np.ndarray) -> Dict[str, Dict[str, np.ndarray]]:
+        """
+        Derive violations from the raw detections of a single frame.
+        
+        Each violation type maps to a struct-of-arrays buffer with at least
+        'xyxy' (int32[N, 4]) and 'conf' (float32[N]); rider violations also
+        carry 'vehicle_xyxy' and triple riding carries 'rider_count'.
+        """
+        # Detect no-helmet and triple riding for motorcycles
+        bikes = np.flatnonzero(cls == 3)  # Motorcycle
+        persons = np.flatnonzero(cls == self.person_class)
+        rider_mask = self._find_riders(xyxy[persons], xyxy[bikes])
+        
+        # One (bike, rider) pair per True entry, ordered by bike then rider
+        pair_bike, pair_rider = np.nonzero(rider_mask)
+        riders = persons[pair_rider]
+        no_helmet = ~self._is_wearing_helmet(frame, xyxy[riders])
+        
+        rider_count = rider_mask.sum(axis=1).astype(np.int32)
+        triple = rider_count >= 3
+        
+        # Detect no-seatbelt for cars
+        cars = np.flatnonzero(cls == 2)  # Car
+        no_seatbelt = ~self._is_wearing_seatbelt(frame, xyxy[cars])
+        
+        # Check for wrong-way driving (simplified - would need additional logic)
+        # This is a placeholder - actual implementation would require tracking
+        # and analyzing vehicle direction against road direction
+        
+        return {
+            'no_helmet': {
+                'xyxy': xyxy[riders[no_helmet]],
+                'conf': conf[riders[no_helmet]],
+                'vehicle_xyxy': xyxy[bikes[pair_bike[no_helmet]]]
+            },
+            'no_seatbelt': {
+                'xyxy': xyxy[cars[no_seatbelt]],
+                'conf': conf[cars[no_seatbelt]]
+            },
+            'triple_riding': {
+                'xyxy': xyxy[bikes[triple]],
+                'conf': conf[bikes[triple]],
+                'rider_count': rider_count[triple]
+            },
+            'wrong_way': {
+                'xyxy': np.empty((0, 4), dtype=np.int32),
+                'conf': np.empty(0, dtype=np.float32)
+            }
+        }
+    
+    def _find_riders(self, person_xyxy: np.ndarray, bike_xyxy: np.ndarray) -> np.ndarray:
+        """
+        Find persons that are likely riding each motorcycle.
+        
+        Args:
+            person_xyxy: (P, 4) int32 person boxes
+            bike_xyxy: (M, 4) int32 motorcycle boxes
             
-        return violations
-    
-    def _find_riders(self, all_detections: np.ndarray, bike_bbox: List[int]) -> List[Dict]:
-        """Find persons that are likely riding the motorcycle."""
-        riders = []
-        bike_x1, bike_y1, bike_x2, bike_y2 = bike_bbox
-        bike_center = ((bike_x1 + bike_x2) // 2, (bike_y1 + bike_y2) // 2)
-        
-        for *xyxy, conf, cls in all_detections:
-            if int(cls) == self.person_class:  # Person class
-                x1, y1, x2, y2 = map(int, xyxy)
-                person_center = ((x1 + x2) // 2, (y1 + y2) // 2)
-                
-                # Check if person is within a certain distance from the bike
-                if (abs(person_center[0] - bike_center[0]) < 100 and 
-                    abs(person_center[1] - bike_center[1]) < 100):
-                    riders.append({
-                        'bbox': [x1, y1, x2, y2],
-                        'confidence': float(conf)
-                    })
-        
-        return riders
-    
-    def _is_wearing_helmet(self, frame: np.ndarray, person_bbox: List[int]) -> bool:
-        """Check if a person is wearing a helmet."""
+        Returns:
+            (M, P) boolean mask of persons near each bike
+        """
+        person_cx = (person_xyxy[:, 0] + person_xyxy[:, 2]) // 2
+        person_cy = (person_xyxy[:, 1] + person_xyxy[:, 3]) // 2
+        bike_cx = (bike_xyxy[:, 0] + bike_xyxy[:, 2]) // 2
+        bike_cy = (bike_xyxy[:, 1] + bike_xyxy[:, 3]) // 2
+        
+        # A person is a rider if within 100px of the bike center on both axes
+        return ((np.abs(person_cx[None, :] - bike_cx[:, None]) < 100) &
+                (np.abs(person_cy[None, :] - bike_cy[:, None]) < 100))
+    
+    def _is_wearing_helmet(self, frame: np.ndarray, person_xyxy: np.ndarray) -> np.ndarray:
+        """Check which of the given persons are wearing a helmet."""
         # This is a simplified version - in practice, you would use a helmet detection model
         # Here we'll just return a random value for demonstration
-        return np.random.random() > 0.5  # 50% chance of detection
+        return self._rng.random(len(person_xyxy)) > 0.5  # 50% chance of detection
     
-    def _is_wearing_seatbelt(self, frame: np.ndarray, car_bbox: List[int]) -> bool:
-        """Check if the driver is wearing a seatbelt."""
+    def _is_wearing_seatbelt(self, frame: np.ndarray, car_xyxy: np.ndarray) -> np.ndarray:
+        """Check which of the given cars' drivers are wearing a seatbelt."""
         # This is a simplified version - in practice, you would use a seatbelt detection model
         # Here we'll just return a random value for demonstration
-        return np.random.random() > 0.3  # 70% chance of detection
+        return self._rng.random(len(car_xyxy)) > 0.3  # 70% chance of detection
     
     def detect_license_plate(self, frame: np.ndarray, vehicle_bbox: List[int]) -> Optional[Dict]:
         """
@@ -178,41 +617,99 @@ class ViolationDetector:
         Returns:
             Dictionary with license plate information or None if not found
         """
+        return self.detect_license_plates_batch(frame, [vehicle_bbox])[0]
+    
+    def detect_license_plates_batch(self, frame: np.ndarray, vehicle_bboxes: List[List[int]]) -> List[Optional[Dict]]:
+        """
+        Detect and recognize license plates for several vehicles of one frame in a single call.
+        
+        Args:
+            frame: Input BGR image
+            vehicle_bboxes: Bounding boxes of the vehicles [[x1, y1, x2, y2], ...]
+            
+        Returns:
+            One license plate dictionary (or None if not found) per vehicle bbox
+        """
         # This is a placeholder - in practice, you would use an ANPR (Automatic Number Plate Recognition) model
-        # For demonstration, we'll return a mock license plate sometimes
-        if np.random.random() > 0.7:  # 30% chance of detecting a plate
-            return {
-                'number': f"KA{np.random.randint(1, 100):02d}AB{np.random.randint(1000, 9999)}",
+        # over all vehicle crops at once; for demonstration, we'll return a mock license plate sometimes
+        hits = self._rng.random(len(vehicle_bboxes)) > 0.7  # 30% chance of detecting a plate
+        numbers = self._rng.integers([1, 1000], [100, 9999], size=(int(hits.sum()), 2)).tolist()
+        
+        plates = []
+        for (x1, y1, x2, _), hit in zip(vehicle_bboxes, hits.tolist()):
+            if not hit:
+                plates.append(None)
+                continue
+            district, serial = numbers.pop()
+            plates.append({
+                'number': f"KA{district:02d}AB{serial}",
                 'confidence': 0.9,
                 'bbox': [
-                    vehicle_bbox[0] + 10,
-                    vehicle_bbox[1] + 10,
-                    vehicle_bbox[2] - 10,
-                    vehicle_bbox[1] + 40  # Approximate plate position
+                    x1 + 10,
+                    y1 + 10,
+                    x2 - 10,
+                    y1 + 40  # Approximate plate position
                 ]
-            }
-        return None
+            })
+        return plates
 
 class TrafficAnalyzer:
     """Class for analyzing traffic flow and generating statistics."""
     
     def __init__(self):
-        self.vehicle_count_history = []
         self.max_history = 100  # Keep last 100 data points
+        self.vehicle_count_history = deque(maxlen=self.max_history)
+        
+        # Regression window for predict_congestion, kept as running sums updated on every point
+        self.trend_window = 10
+        self._trend_t = deque(maxlen=self.trend_window)
+        self._trend_y = deque(maxlen=self.trend_window)
+        self._trend_origin = None  # x is minutes since this timestamp, keeping the sums small
+        self._since_rebase = 0  # points added since the sums were last recomputed
+        self._sx = self._sy = self._sxx = self._sxy = 0.0
+        
+        # Updates come from both the request batcher's executor and the stream thread
+        self._lock = threading.Lock()
         
     def update_vehicle_count(self, count: int, timestamp: float = None):
-        """Update vehicle count history."""
+        """Update vehicle count history (timestamp in epoch seconds, defaults to now)."""
         if timestamp is None:
-            timestamp = datetime.now().timestamp()
-            
-        self.vehicle_count_history.append({
-            'timestamp': timestamp,
-            'count': count
-        })
+            timestamp = time.time()
         
-        # Keep only the most recent data points
-        if len(self.vehicle_count_history) > self.max_history:
-            self.vehicle_count_history = self.vehicle_count_history[-self.max_history:]
+        with self._lock:
+            self.vehicle_count_history.append({
+                'timestamp': timestamp,
+                'count': count
+            })
+            
+            # Slide the regression window: drop the evicted point's terms, add the new one
+            if len(self._trend_t) == self.trend_window:
+                self._add_trend_point(self._trend_t[0], self._trend_y[0], -1)
+            self._trend_t.append(timestamp)
+            self._trend_y.append(count)
+            
+            # Recompute once per window: x stays within the window span, and add/subtract
+            # cancellation error is discarded before it can build up (amortized O(1))
+            self._since_rebase += 1
+            if self._trend_origin is None or self._since_rebase >= self.trend_window:
+                self._rebase_trend()
+            else:
+                self._add_trend_point(timestamp, count, 1)
+    
+    def _add_trend_point(self, timestamp: float, count: int, sign: int):
+        x = (timestamp - self._trend_origin) / 60
+        self._sx += sign * x
+        self._sy += sign * count
+        self._sxx += sign * x * x
+        self._sxy += sign * x * count
+    
+    def _rebase_trend(self):
+        """Recompute the running sums relative to the oldest point (bounds x and float drift)."""
+        self._trend_origin = self._trend_t[0]
+        self._since_rebase = 0
+        self._sx = self._sy = self._sxx = self._sxy = 0.0
+        for t, y in zip(self._trend_t, self._trend_y):
+            self._add_trend_point(t, y, 1)
     
     def get_traffic_density(self, window_minutes: int = 5) -> float:
         """Calculate traffic density over the specified time window."""
@@ -220,13 +717,14 @@ class TrafficAnalyzer:
             return 0.0
             
         window_seconds = window_minutes * 60
-        now = datetime.now().timestamp()
+        now = time.time()
         
         # Get counts within the time window
-        recent_counts = [
-            point['count'] for point in self.vehicle_count_history
-            if (now - point['timestamp']) <= window_seconds
-        ]
+        with self._lock:
+            recent_counts = [
+                point['count'] for point in self.vehicle_count_history
+                if (now - point['timestamp']) <= window_seconds
+            ]
         
         if not recent_counts:
             return 0.0
@@ -240,19 +738,15 @@ class TrafficAnalyzer:
         if len(self.vehicle_count_history) < 2:
             return 0.0
             
-        # Simple linear extrapolation
-        recent = self.vehicle_count_history[-10:]  # Last 10 data points
-        if len(recent) < 2:
-            return recent[0]['count'] if recent else 0.0
+        # Simple linear extrapolation over the last 10 data points, O(1) from the running sums
+        with self._lock:
+            n = len(self._trend_t)
+            denom = n * self._sxx - self._sx * self._sx
+            if denom > 1e-12:  # Check if we have enough data
+                slope = (n * self._sxy - self._sx * self._sy) / denom
+                intercept = (self._sy - slope * self._sx) / n
+                x_last = (self._trend_t[-1] - self._trend_origin) / 60
+                predicted = slope * (x_last + lookahead_minutes) + intercept
+                return max(0, predicted)  # Don't return negative counts
             
-        # Calculate trend (simple linear regression)
-        x = np.array([(point['timestamp'] - recent[0]['timestamp']) / 60 for point in recent])
-        y = np.array([point['count'] for point in recent])
-        
-        if len(x) > 1 and np.ptp(x) > 0:  # Check if we have enough data
-            z = np.polyfit(x, y, 1)
-            p = np.poly1d(z)
-            predicted = p(x[-1] + lookahead_minutes)
-            return max(0, predicted)  # Don't return negative counts
-        
-        return y[-1]  # Return last known count if prediction not possible
+            return self._trend_y[-1]  # Return last known count if prediction not possible
@@ -0,0 +1,101 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Callable, Iterator, Optional, Tuple
+
+from sortedcontainers import SortedDict, SortedKeyList
+
+_HOUR = timedelta(hours=1)
+
+
+def _hour_floor(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+class TimeIndexedStore:
+    """Bounded in-memory record store kept sorted by timestamp, with per-type and per-hour aggregates."""
+
+    def __init__(self, timestamp_key: Callable[[Any], datetime],
+                 type_key: Optional[Callable[[Any], str]] = None,
+                 value_key: Optional[Callable[[Any], float]] = None,
+                 maxlen: Optional[int] = None):
+        """
+        Initialize the store.
+
+        Args:
+            timestamp_key: Returns the timestamp of a record
+            type_key: Returns the category of a record, counted on insert
+            value_key: Returns the numeric value of a record, summed per hour bucket
+            maxlen: Maximum number of records kept; the oldest are evicted first
+        """
+        self._items = SortedKeyList(key=timestamp_key)
+        self._timestamp_key = timestamp_key
+        self._type_key = type_key
+        self._value_key = value_key
+        self.maxlen = maxlen
+        self.type_counts: Counter = Counter()
+        self._hours = SortedDict()  # hour start -> [record count, value sum]
+
+    def append(self, item: Any):
+        """Insert a record, keeping timestamp order and evicting the oldest past maxlen."""
+        self._items.add(item)
+        self._account(item, 1)
+        if self.maxlen is not None and len(self._items) > self.maxlen:
+            self._account(self._items.pop(0), -1)
+
+    def _account(self, item: Any, sign: int):
+        """Add (sign=1) or remove (sign=-1) a record from the aggregates."""
+        if self._type_key:
+            kind = self._type_key(item)
+            self.type_counts[kind] += sign
+            if self.type_counts[kind] <= 0:
+                del self.type_counts[kind]
+
+        hour = _hour_floor(self._timestamp_key(item))
+        bucket = self._hours.setdefault(hour, [0, 0])
+        bucket[0] += sign
+        if self._value_key:
+            bucket[1] += sign * self._value_key(item)
+        if bucket[0] <= 0:
+            del self._hours[hour]
+
+    def between(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                reverse: bool = False) -> Iterator[Any]:
+        """Iterate records with start <= timestamp <= end (either bound may be None)."""
+        return self._items.irange_key(start, end, reverse=reverse)
+
+    def count_since(self, start: datetime) -> int:
+        """Number of records with timestamp >= start."""
+        return len(self._items) - self._items.bisect_key_left(start)
+
+    def totals_since(self, start: datetime) -> Tuple[int, float]:
+        """
+        Record count and value sum for records with timestamp >= start.
+
+        Whole hours are read from the hour buckets; only the partial hour
+        containing start is scanned record by record.
+
+        Returns:
+            Tuple of (record count, value sum)
+        """
+        first_full_hour = _hour_floor(start)
+        if first_full_hour < start:
+            first_full_hour += _HOUR
+
+        count, total = 0, 0
+        for item in self._items.irange_key(start, first_full_hour, inclusive=(True, False)):
+            count += 1
+            if self._value_key:
+                total += self._value_key(item)
+
+        for hour in self._hours.irange(first_full_hour):
+            bucket_count, bucket_total = self._hours[hour]
+            count += bucket_count
+            total += bucket_total
+
+        return count, total
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._items)
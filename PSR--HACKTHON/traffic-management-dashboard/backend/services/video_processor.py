@@ -1,36 +1,160 @@
 import cv2
 import numpy as np
+import torch
 import time
 import threading
+import queue
+import asyncio
 import logging
-from typing import Optional, Dict, List, Callable
+from typing import Optional, Dict, List, Callable, Tuple, Union
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import json
+import os
+import sqlite3
 
-from ..ai.detection import ViolationDetector, TrafficAnalyzer
+from ..ai.detection import ViolationDetector, TrafficAnalyzer, count_detections
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Overlay colors (BGR) and display labels per violation type
+_VIOLATION_COLORS = {
+    'no_helmet': (0, 0, 255),      # Red
+    'no_seatbelt': (255, 0, 0),    # Blue
+    'triple_riding': (0, 165, 255),# Orange
+    'wrong_way': (255, 0, 255)     # Magenta
+}
+_VIOLATION_LABELS = {k: k.replace('_', ' ').title() for k in _VIOLATION_COLORS}
+
+# Quality 75 is visually identical to the default 95 on small crops at about half the size;
+# optimized Huffman tables and progressive scans would each cost an extra pass
+_CROP_JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 75, cv2.IMWRITE_JPEG_OPTIMIZE, 0, cv2.IMWRITE_JPEG_PROGRESSIVE, 0]
+
+def _write_violation(img_path: Path, crop: np.ndarray, records: List[Dict],
+                     db: sqlite3.Connection, db_lock: threading.Lock):
+    """Write one violation crop and insert the metadata of every record sharing it (runs on the I/O pool)."""
+    try:
+        ok, buf = cv2.imencode('.jpg', crop, _CROP_JPEG_PARAMS)
+        if not ok:
+            raise ValueError("JPEG encoding failed")
+        with open(img_path, 'xb') as f:  # Exclusive create: a clashing ID errors instead of overwriting
+            f.write(buf.tobytes())
+    except Exception as e:
+        logger.error(f"Error saving violation image {img_path}: {str(e)}")
+    
+    # The records were already reported, so their rows are kept even if the image failed;
+    # one transaction, but a failing row only loses itself
+    try:
+        with db_lock, db:
+            for v in records:
+                try:
+                    db.execute("INSERT INTO violations VALUES (?, ?, ?, ?, ?, ?, ?)", (
+                        v['id'], v['type'], v['timestamp'], v['image_path'], v['confidence'],
+                        json.dumps(v['bbox']), json.dumps(v['plate_info'])
+                    ))
+                except sqlite3.Error as e:
+                    logger.error(f"Error saving violation {v['id']}: {str(e)}")
+    except Exception as e:
+        logger.error(f"Error saving violations for {img_path}: {str(e)}")
+
+def _merge_overlapping(boxes: np.ndarray, iou_thres: float = 0.7) -> np.ndarray:
+    """
+    Greedily merge boxes that overlap an earlier box by more than iou_thres.
+    
+    Args:
+        boxes: (K, 4) int32 xyxy boxes
+        iou_thres: IoU above which two boxes share one crop
+        
+    Returns:
+        (K,) index of the box whose crop each box reuses (itself if unmerged)
+    """
+    x1, y1, x2, y2 = boxes.T.astype(np.int64)
+    area = (x2 - x1) * (y2 - y1)
+    iw = np.clip(np.minimum(x2[:, None], x2) - np.maximum(x1[:, None], x1), 0, None)
+    ih = np.clip(np.minimum(y2[:, None], y2) - np.maximum(y1[:, None], y1), 0, None)
+    inter = iw * ih
+    iou = inter / np.maximum(area[:, None] + area - inter, 1)
+    
+    owner = np.arange(len(boxes))
+    for k in range(len(boxes)):
+        if owner[k] == k:
+            merge = (iou[k] > iou_thres) & (owner == np.arange(len(boxes)))
+            merge[:k + 1] = False
+            owner[merge] = k
+    return owner
+
 class VideoProcessor:
-    def __init__(self, output_dir: str = "data/violations"):
+    def __init__(self, output_dir: str = "data/violations", target_fps: float = 5.0,
+                 draw_on_gpu: bool = None, batch_size: int = 4, batch_window: Optional[float] = None):
         """
         Initialize the video processor.
         
         Args:
             output_dir: Directory to save violation images and data
+            target_fps: Rate at which stream frames are decoded and analyzed
+            draw_on_gpu: Draw overlays on an OpenCL UMat when available,
+                defaults to $VIDEO_DRAW_OPENCL
+            batch_size: Maximum number of stream frames per detector call
+            batch_window: Maximum time in seconds to wait for a batch to fill,
+                defaults to the time the sampler takes to produce batch_size frames
         """
         self.detector = ViolationDetector()
         self.analyzer = TrafficAnalyzer()
+        
+        # OpenCV gets the cores the detector leaves free: one if inference is on the GPU
+        if self.detector.device.startswith('cuda'):
+            cv2.setNumThreads(1)
+        else:
+            cv2.setNumThreads(max(1, (os.cpu_count() or 1) - torch.get_num_threads()))
+        
+        # Optionally pin the capture thread to one core ($VIDEO_CAPTURE_CPU)
+        capture_cpu = os.environ.get('VIDEO_CAPTURE_CPU')
+        self.capture_cpu = int(capture_cpu) if capture_cpu else None
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
         
+        # Overlay drawing through OpenCV's transparent API, only if an OpenCL device exists
+        if draw_on_gpu is None:
+            draw_on_gpu = os.environ.get('VIDEO_DRAW_OPENCL', '0') == '1'
+        self.draw_on_gpu = draw_on_gpu and cv2.ocl.haveOpenCL()
+        if self.draw_on_gpu:
+            cv2.ocl.setUseOpenCL(True)
+            logger.info("Drawing overlays with OpenCL")
+        
+        # JPEG encoding and file writes stay off the detection thread
+        self._io_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="violation-io")
+        
+        # Violation metadata goes to one append-only SQLite table instead of a JSON file each
+        self._db = sqlite3.connect(str(self.output_dir / "violations.db"), check_same_thread=False)
+        self._db_lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS violations ("
+            "id TEXT PRIMARY KEY, type TEXT, ts TEXT, image_path TEXT, "
+            "confidence REAL, bbox_json TEXT, plate_json TEXT)"
+        )
+        self._db.commit()
+        
         # Thread control
         self._stop_event = threading.Event()
         self._thread = None
+        self._capture_thread = None
+        self._frame_queue = queue.Queue(maxsize=batch_size)
         self._stream = None
+        
+        # Reusable frame buffers for retrieve(); in flight at once are one being retrieved,
+        # a batch waiting in the queue, a batch being processed, and one held as last_frame
+        self.frame_pool_size = 2 * batch_size + 2
+        self._free_frames = queue.Queue(maxsize=self.frame_pool_size)
+        self._frame_block = None
+        self.sample_interval = 1.0 / target_fps
+        self.batch_size = batch_size
+        self.batch_window = batch_size * self.sample_interval if batch_window is None else batch_window
         self._callbacks = {
             'violation': [],
             'vehicle_count': [],
@@ -43,7 +167,20 @@ class VideoProcessor:
         self.last_update_time = time.time()
         self.last_frame = None
         self.current_vehicles = 0
-        self.current_violations = {}
+        self._last_violations = None  # Counted on demand by current_violations
+        
+        # Inter-frame result cache for the stream loop, keyed on a 32x32 grayscale thumbnail
+        self.scene_delta_thres = 3.0  # Mean absolute thumbnail difference treated as "unchanged"
+        self.revalidate_every = 10  # Always run the detector on every Nth frame
+        self._last_thumb = None
+        self._last_results = None
+    
+    @property
+    def current_violations(self) -> Dict[str, int]:
+        """Violation counts by type for the last processed frame."""
+        if self._last_violations is None:
+            return {}
+        return {violation_type: count_detections(dets) for violation_type, dets in self._last_violations.items()}
     
     def register_callback(self, event_type: str, callback: Callable):
         """Register a callback for processing events."""
@@ -70,49 +207,165 @@ class VideoProcessor:
             return False
             
         self._stop_event.clear()
+        self._frame_queue = queue.Queue(maxsize=self.batch_size)
+        self._last_thumb = self._last_results = None
+        
+        # Capture and detection run in separate threads so decode/network latency
+        # overlaps with inference instead of adding to it
+        self._capture_thread = threading.Thread(
+            target=self._capture_stream,
+            args=(source,),
+            daemon=True
+        )
         self._thread = threading.Thread(
             target=self._process_stream,
-            args=(source,),
             daemon=True
         )
+        self._capture_thread.start()
         self._thread.start()
         return True
     
     def stop_processing(self):
-        """Stop the video processing thread."""
+        """Stop the capture and video processing threads."""
         self._stop_event.set()
+        if self._capture_thread:
+            self._capture_thread.join(timeout=5.0)
         if self._thread:
             self._thread.join(timeout=5.0)
         if self._stream and self._stream.isOpened():
             self._stream.release()
     
-    def _process_stream(self, source: str):
-        """Process video stream in a separate thread."""
+    def close(self):
+        """Stop processing, flush pending violation writes and close the metadata database."""
+        self.stop_processing()
+        self._io_pool.shutdown(wait=True)
+        with self._db_lock:
+            self._db.close()
+    
+    def _capture_stream(self, source: str):
+        """Producer: pull sampled frames into the batch queue, dropping the oldest when it is full."""
         try:
+            if self.capture_cpu is not None and hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(0, {self.capture_cpu})  # pid 0 applies to the calling thread on Linux
+            
             # Open the video source
             if source.isdigit():
                 source = int(source)  # Camera index
                 
-            self._stream = cv2.VideoCapture(source)
+            self._stream = self._open_capture(source)
             if not self._stream.isOpened():
                 logger.error(f"Failed to open video source: {source}")
                 return
                 
             logger.info(f"Started processing video from: {source}")
-            frame_count = 0
-            start_time = time.time()
+            last_retrieve = 0.0
+            
+            # Preallocate the frame pool at the source resolution (if the backend reports it)
+            # as views into one stacked block, so batches never allocate frame memory
+            self._free_frames = queue.Queue(maxsize=self.frame_pool_size)
+            width = int(self._stream.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(self._stream.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            if width > 0 and height > 0:
+                self._frame_block = np.empty((self.frame_pool_size, height, width, 3), dtype=np.uint8)
+                for buf in self._frame_block:
+                    self._free_frames.put_nowait(buf)
+            
+            # Live sources block in grab() at their own rate; files decode as fast as possible,
+            # so pace them to their nominal frame rate instead
+            fps = self._stream.get(cv2.CAP_PROP_FPS) if isinstance(source, str) and os.path.isfile(source) else 0
+            frame_period = 1.0 / fps if fps and fps > 0 else 0.0
+            next_deadline = time.time()
             
             while not self._stop_event.is_set():
-                ret, frame = self._stream.read()
-                if not ret:
+                if frame_period:
+                    next_deadline += frame_period
+                    delay = next_deadline - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        next_deadline = time.time()  # Fell behind; do not burst to catch up
+                
+                # grab() only advances the decoder; it also paces the loop to live source rates
+                if not self._stream.grab():
                     logger.warning("Failed to read frame from source")
                     time.sleep(1)  # Avoid tight loop on error
                     continue
                 
-                # Process the frame
-                processed_frame, results = self._process_frame(frame)
-                self.last_frame = processed_frame
-                frame_count += 1
+                # Only convert frames to BGR at the analysis rate
+                now = time.time()
+                if now - last_retrieve < self.sample_interval:
+                    continue
+                try:
+                    buf = self._free_frames.get_nowait()
+                except queue.Empty:
+                    buf = None  # Pool exhausted or size unknown: let OpenCV allocate
+                ret, frame = self._stream.retrieve(buf) if buf is not None else self._stream.retrieve()
+                if not ret:
+                    self._release_frame(buf)
+                    continue
+                last_retrieve = now
+                
+                # Drop the oldest frame if the detector has fallen a whole batch behind
+                if self._frame_queue.full():
+                    try:
+                        self._release_frame(self._frame_queue.get_nowait())
+                    except queue.Empty:
+                        pass
+                self._frame_queue.put(frame)
+                
+        except Exception as e:
+            logger.error(f"Error in video capture thread: {str(e)}")
+        finally:
+            if self._stream and self._stream.isOpened():
+                self._stream.release()
+            logger.info("Video capture stopped")
+    
+    def _release_frame(self, frame: Optional[np.ndarray]):
+        """Return a frame buffer to the pool for reuse by retrieve()."""
+        if frame is None:
+            return
+        try:
+            self._free_frames.put_nowait(frame)
+        except queue.Full:
+            pass  # Pool already full (e.g. an OpenCV-allocated frame); let it be freed
+    
+    def _process_stream(self):
+        """Consumer: collect captured frames into windows and run detection on each window."""
+        try:
+            frame_count = 0
+            start_time = time.time()
+            batch = []
+            deadline = 0.0
+            
+            while not self._stop_event.is_set():
+                # Close the window after batch_size frames or batch_window seconds, whichever comes first
+                timeout = max(0.0, deadline - time.time()) if batch else 1
+                try:
+                    batch.append(self._frame_queue.get(timeout=timeout))
+                    if len(batch) == 1:
+                        deadline = time.time() + self.batch_window
+                    if len(batch) < self.batch_size and time.time() < deadline:
+                        continue
+                except queue.Empty:
+                    if not batch:
+                        if not self._capture_thread.is_alive():
+                            break  # Source closed or failed to open
+                        continue
+                
+                outputs = self._process_stream_frames(batch)
+                
+                # Hand buffers back to the pool; only the newest drawn frame stays as last_frame
+                for frame, (processed_frame, _) in zip(batch, outputs):
+                    if processed_frame is not frame:
+                        self._release_frame(frame)
+                for processed_frame, _ in outputs[:-1]:
+                    self._release_frame(processed_frame)
+                previous, self.last_frame = self.last_frame, outputs[-1][0]
+                self._release_frame(previous)
+                
+                self.frame_count += len(batch)
+                frame_count += len(batch)
+                batch = []
                 
                 # Update FPS every second
                 elapsed = time.time() - start_time
@@ -121,155 +374,383 @@ class VideoProcessor:
                     frame_count = 0
                     start_time = time.time()
                 
-                # Small delay to prevent 100% CPU usage
-                time.sleep(0.01)
-                
         except Exception as e:
             logger.error(f"Error in video processing thread: {str(e)}")
         finally:
-            if self._stream and self._stream.isOpened():
-                self._stream.release()
             logger.info("Video processing stopped")
     
-    def _process_frame(self, frame: np.ndarray) -> tuple:
-        """Process a single video frame."""
-        # Make a copy of the frame for processing
-        processed_frame = frame.copy()
+    async def start_processing_async(self, sources: List[str]):
+        """
+        Process several RTSP/file sources on the event loop with PyAV, batching frames across sources.
+        
+        Each source gets a reader task that demuxes and decodes in the default executor (PyAV
+        releases the GIL while decoding) and keeps only its newest sampled frame in its own slot. A
+        single detector task takes the frame from every filled slot and runs one batched detector
+        call over them.
+        Returns once every source has ended or stop_processing() was called; if detection fails,
+        the readers are stopped and the error is raised.
+        
+        Args:
+            sources: Video sources (RTSP URLs or file paths)
+        """
+        try:
+            import av
+        except ImportError as e:
+            raise RuntimeError("Async stream processing requested but the av package is not installed") from e
         
-        # Detect vehicles and violations
-        vehicles = self.detector.detect_vehicles(processed_frame)
-        violations = self.detector.detect_violations(processed_frame)
+        self._stop_event.clear()
         
+        # One slot per source, so a fast source only ever replaces its own pending frame
+        slots: Dict[int, np.ndarray] = {}
+        ready = asyncio.Event()
+        detector = asyncio.create_task(self._detect_async(slots, ready))
+        readers = asyncio.gather(*(
+            self._read_source_async(av, source, slots, key, ready) for key, source in enumerate(sources)
+        ))
+        try:
+            # The detector task only finishes by failing; stop the readers rather than decode for nobody
+            done, _ = await asyncio.wait({detector, readers}, return_when=asyncio.FIRST_COMPLETED)
+            if detector in done:
+                self._stop_event.set()
+                await readers
+                logger.error(f"Error in async detection: {str(detector.exception())}")
+                detector.result()
+        finally:
+            detector.cancel()
+            try:
+                await detector
+            except asyncio.CancelledError:
+                pass
+    
+    async def _read_source_async(self, av, source: str, slots: Dict[int, np.ndarray], key: int,
+                                 ready: asyncio.Event):
+        """Decode one source into its slot (slots[key]), replacing its frame if not yet taken."""
+        loop = asyncio.get_running_loop()
+        try:
+            container = await loop.run_in_executor(None, partial(
+                av.open, source, options={'rtsp_transport': 'tcp', 'fflags': 'nobuffer'}
+            ))
+        except Exception as e:
+            logger.error(f"Failed to open video source: {source} ({str(e)})")
+            return
+        
+        logger.info(f"Started async processing of video from: {source}")
+        decoded = container.decode(video=0)
+        
+        # Live sources deliver frames at their own rate; files decode as fast as possible,
+        # so pace them to their nominal frame rate instead
+        rate = container.streams.video[0].average_rate if os.path.isfile(source) else None
+        if rate:
+            decoded = self._paced(decoded, 1.0 / float(rate))
+        last_sample = 0.0
+        try:
+            while not self._stop_event.is_set():
+                frame, last_sample = await loop.run_in_executor(None, self._next_sampled_frame, decoded, last_sample)
+                if frame is None:
+                    break  # End of stream
+                slots[key] = frame
+                ready.set()
+        except Exception as e:
+            logger.error(f"Error reading video source {source}: {str(e)}")
+        finally:
+            container.close()
+            logger.info(f"Async processing of {source} stopped")
+    
+    @staticmethod
+    def _paced(frames, frame_period: float):
+        """Yield frames no faster than one per frame_period, without bursting to catch up."""
+        next_deadline = time.time()
+        for frame in frames:
+            next_deadline += frame_period
+            delay = next_deadline - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_deadline = time.time()  # Fell behind; do not burst to catch up
+            yield frame
+    
+    def _next_sampled_frame(self, decoded, last_sample: float) -> Tuple[Optional[np.ndarray], float]:
+        """Decode up to the next frame due at the sampling rate and convert only that one to BGR."""
+        for frame in decoded:
+            now = time.time()
+            if now - last_sample >= self.sample_interval:
+                return frame.to_ndarray(format='bgr24'), now
+        return None, last_sample
+    
+    async def _detect_async(self, slots: Dict[int, np.ndarray], ready: asyncio.Event):
+        """Run batched detection over the frames of every filled slot, one executor call per batch."""
+        loop = asyncio.get_running_loop()
+        frame_count = 0
+        start_time = time.time()
+        while True:
+            await ready.wait()
+            ready.clear()
+            frames = list(slots.values())
+            slots.clear()
+            
+            results = await loop.run_in_executor(None, self._process_frames, frames)
+            self.last_frame = results[-1][0]
+            self.frame_count += len(frames)
+            frame_count += len(frames)
+            
+            # Update FPS every second
+            elapsed = time.time() - start_time
+            if elapsed >= 1.0:
+                self.processing_fps = frame_count / elapsed
+                frame_count = 0
+                start_time = time.time()
+    
+    @staticmethod
+    def _open_capture(source) -> cv2.VideoCapture:
+        """Open a capture that keeps at most one frame buffered, so reads never return a backlog."""
+        if isinstance(source, str) and source.lower().startswith('rtsp://'):
+            # Must be set before opening: TCP transport and no demuxer-side buffering
+            os.environ.setdefault('OPENCV_FFMPEG_CAPTURE_OPTIONS', 'rtsp_transport;tcp|fflags;nobuffer')
+            stream = cv2.VideoCapture(source, cv2.CAP_FFMPEG)
+        else:
+            stream = cv2.VideoCapture(source)
+        stream.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Ignored by backends that do not support it
+        return stream
+    
+    def _process_stream_frames(self, frames: List[np.ndarray]) -> List[tuple]:
+        """
+        Process a window of stream frames with at most one batched detector call.
+        
+        Frames whose scene is unchanged since the last detection reuse its results;
+        only the remaining frames go through the detector, together.
+        """
+        thumbs = [cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (32, 32), interpolation=cv2.INTER_AREA)
+                  for frame in frames]
+        cached = [
+            self._last_results is not None and (self.frame_count + i) % self.revalidate_every != 0 and
+            np.mean(np.abs(thumb.astype(np.int16) - self._last_thumb)) < self.scene_delta_thres
+            for i, thumb in enumerate(thumbs)
+        ]
+        fresh = [i for i, hit in enumerate(cached) if not hit]
+        detections = dict(zip(fresh, self._detect_frames([frames[i] for i in fresh]))) if fresh else {}
+        
+        outputs = []
+        for i, frame in enumerate(frames):
+            # Labels on alternate frames are indistinguishable at stream rates
+            draw_labels = (self.frame_count + i) % 2 == 0
+            if cached[i]:
+                # Same vehicles in the same places: redraw them, but do not re-report their violations
+                vehicles, violations = self._last_results
+                outputs.append(self._postprocess_frame(frame, vehicles, violations, draw_labels,
+                                                       report_violations=False))
+            else:
+                vehicles, violations = detections[i]
+                outputs.append(self._postprocess_frame(frame, vehicles, violations, draw_labels))
+        
+        if fresh:
+            self._last_thumb = thumbs[fresh[-1]]
+            self._last_results = detections[fresh[-1]]
+        return outputs
+    
+    def _process_frame(self, frame: np.ndarray, draw_labels: bool = True) -> tuple:
+        """Process a single video frame."""
+        return self._process_frames([frame], draw_labels=draw_labels)[0]
+    
+    def _process_frames(self, frames: List[np.ndarray], draw_labels: bool = True) -> List[tuple]:
+        """Process several frames with a single batched detector call."""
+        return [
+            self._postprocess_frame(frame, vehicles, violations, draw_labels)
+            for frame, (vehicles, violations) in zip(frames, self._detect_frames(frames))
+        ]
+    
+    def _detect_frames(self, frames: List[np.ndarray]) -> List[tuple]:
+        """Run the detector once over a batch of frames."""
+        # Downscale each frame once to the network input size; detection runs on the small
+        # copies and boxes come back in full-resolution coordinates for cropping and drawing
+        resized = [self.detector.resize_to_input(frame) for frame in frames]
+        
+        # Detect vehicles and violations with one forward pass for the whole batch;
+        # the detector only reads the frames, so no defensive copy is needed here
+        return self.detector.detect_all_batch(frames, resized)
+    
+    def _postprocess_frame(self, frame: np.ndarray, vehicles: Dict[str, np.ndarray], violations: Dict,
+                           draw_labels: bool = True, report_violations: bool = True) -> tuple:
+        """Update state, handle violations and draw overlays for one analyzed frame."""
         # Update traffic analyzer
-        self.analyzer.update_vehicle_count(len(vehicles))
+        self.analyzer.update_vehicle_count(count_detections(vehicles))
         
-        # Process violations
-        self._handle_violations(violations, processed_frame)
+        # One clock read per frame, shared by every record and callback it produces; UTC like
+        # the API's stores and time windows
+        now = datetime.utcnow()
+        iso = now.isoformat()
         
-        # Draw detections on frame
-        self._draw_detections(processed_frame, vehicles, violations)
+        # Process violations (crops come from the undrawn frame)
+        if report_violations:
+            self._handle_violations(violations, frame, iso, now.strftime("%Y%m%d_%H%M%S_%f"))
+        
+        # Draw detections in place; violation crops were already copied out of the clean pixels
+        if self.draw_on_gpu:
+            canvas = cv2.UMat(frame)
+            self._draw_detections(canvas, vehicles, violations, draw_labels)
+            processed_frame = canvas.get()  # Callers and the JPEG writer expect an ndarray
+        else:
+            processed_frame = frame
+            self._draw_detections(processed_frame, vehicles, violations, draw_labels)
         
         # Update state
-        self.current_vehicles = len(vehicles)
-        self.current_violations = {
-            'no_helmet': len(violations['no_helmet']),
-            'no_seatbelt': len(violations['no_seatbelt']),
-            'triple_riding': len(violations['triple_riding']),
-            'wrong_way': len(violations['wrong_way'])
-        }
+        self.current_vehicles = count_detections(vehicles)
+        self._last_violations = violations
         
-        # Trigger callbacks
-        self._trigger_callbacks('frame_processed', {
-            'frame': processed_frame,
-            'vehicles': vehicles,
-            'violations': violations,
-            'timestamp': datetime.now().isoformat()
-        })
+        # Trigger callbacks (skipped entirely without subscribers, so the frame is not held on to)
+        if self._callbacks['frame_processed']:
+            self._trigger_callbacks('frame_processed', {
+                'frame': processed_frame,
+                'vehicles': vehicles,
+                'violations': violations,
+                'timestamp': iso
+            })
         
         return processed_frame, {'vehicles': vehicles, 'violations': violations}
     
-    def _handle_violations(self, violations: Dict, frame: np.ndarray):
-        """Handle detected violations (save images, trigger alerts, etc.)."""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    def _handle_violations(self, violations: Dict, frame: np.ndarray, iso: str, tstamp: str):
+        """
+        Handle detected violations (save images, trigger alerts, etc.).
         
-        # Process each type of violation
-        for violation_type, violation_list in violations.items():
-            if not violation_list:
+        Args:
+            violations: Dictionary of violation buffers by type
+            frame: Undrawn frame the crops are taken from
+            iso: ISO timestamp of the frame
+            tstamp: Compact frame timestamp used in violation IDs
+        """
+        # Gather every violation crop across types
+        entries = []  # (violation type, index within type, crop box)
+        for violation_type, dets in violations.items():
+            if not count_detections(dets):
                 continue
-                
-            for i, violation in enumerate(violation_list):
-                # Extract vehicle region
-                bbox = violation.get('vehicle_bbox', violation['bbox'])
-                x1, y1, x2, y2 = bbox
-                vehicle_img = frame[y1:y2, x1:x2]
-                
-                if vehicle_img.size == 0:
-                    continue
-                
-                # Generate a unique ID for this violation
-                violation_id = f"{timestamp}_{violation_type}_{i}"
-                
-                # Save violation image
-                img_path = self.output_dir / f"{violation_id}.jpg"
-                cv2.imwrite(str(img_path), vehicle_img)
-                
-                # Try to detect license plate
-                plate_info = None
-                if 'vehicle_bbox' in violation:
-                    plate_info = self.detector.detect_license_plate(frame, violation['vehicle_bbox'])
-                
-                # Prepare violation data
-                violation_data = {
-                    'id': violation_id,
-                    'type': violation_type,
-                    'timestamp': datetime.now().isoformat(),
-                    'image_path': str(img_path),
-                    'confidence': violation.get('confidence', 0.0),
-                    'bbox': violation['bbox'],
-                    'plate_info': plate_info
-                }
-                
-                # Save violation metadata
-                with open(self.output_dir / f"{violation_id}.json", 'w') as f:
-                    json.dump(violation_data, f, indent=2)
-                
-                # Trigger violation callback
-                self._trigger_callbacks('violation', violation_data)
+            
+            # Crop around the vehicle for violations with vehicle context
+            crop_boxes = dets.get('vehicle_xyxy', dets['xyxy']).tolist()
+            for i, box in enumerate(crop_boxes):
+                x1, y1, x2, y2 = box
+                if x2 > x1 and y2 > y1:
+                    entries.append((violation_type, i, box))
+        
+        if not entries:
+            return
+        
+        # Overlapping violations (e.g. triple riding + no helmet on one bike) share one encoded crop
+        owner = _merge_overlapping(np.array([box for _, _, box in entries], dtype=np.int32))
+        crops = {}  # owner index -> (image path, crop, records)
+        
+        # Read plates once per distinct vehicle in a single batched call
+        plate_boxes = list(dict.fromkeys(
+            tuple(box) for violation_type, _, box in entries if 'vehicle_xyxy' in violations[violation_type]
+        ))
+        plates = dict(zip(plate_boxes, self.detector.detect_license_plates_batch(frame, [list(b) for b in plate_boxes])))
+        
+        for k, (violation_type, i, (x1, y1, x2, y2)) in enumerate(entries):
+            dets = violations[violation_type]
+            
+            # Generate a unique ID for this violation
+            violation_id = f"{tstamp}_{violation_type}_{i}"
+            
+            if owner[k] == k:
+                # Copied because the frame is drawn on (and later reused) before the write runs
+                crops[k] = (self.output_dir / f"{violation_id}.jpg", frame[y1:y2, x1:x2].copy(), [])
+            img_path, _, records = crops[owner[k]]
+            
+            # License plate of the vehicle, if it has been read
+            plate_info = plates.get((x1, y1, x2, y2)) if 'vehicle_xyxy' in dets else None
+            
+            # Prepare violation data
+            violation_data = {
+                'id': violation_id,
+                'type': violation_type,
+                'timestamp': iso,
+                'image_path': str(img_path),
+                'confidence': float(dets['conf'][i]),
+                'bbox': dets['xyxy'][i].tolist(),
+                'plate_info': plate_info
+            }
+            records.append(violation_data)
+            
+            # Trigger violation callback
+            self._trigger_callbacks('violation', violation_data)
+        
+        # Save each unique crop once, with all records pointing at it, in the background
+        for img_path, crop, records in crops.values():
+            self._io_pool.submit(_write_violation, img_path, crop, records, self._db, self._db_lock)
+    
+    @staticmethod
+    def _box_polygons(xyxy: np.ndarray) -> np.ndarray:
+        """Convert (N, 4) int32 boxes to (N, 4, 2) corner polygons for cv2.polylines."""
+        x1, y1, x2, y2 = xyxy.T
+        return np.stack([
+            np.stack([x1, y1], axis=-1),
+            np.stack([x2, y1], axis=-1),
+            np.stack([x2, y2], axis=-1),
+            np.stack([x1, y2], axis=-1)
+        ], axis=1)
     
-    def _draw_detections(self, frame: np.ndarray, vehicles: List[Dict], violations: Dict):
-        """Draw detection and violation bounding boxes on the frame."""
+    def _draw_boxes(self, frame: Union[np.ndarray, cv2.UMat], boxes: np.ndarray, color: tuple, thickness: int):
+        """Draw all boxes of one color."""
+        if isinstance(frame, cv2.UMat):
+            # polylines has no usable UMat overload for a list of contours
+            for x1, y1, x2, y2 in boxes.tolist():
+                cv2.rectangle(frame, (x1, y1), (x2, y2), color, thickness)
+        else:
+            cv2.polylines(frame, self._box_polygons(boxes), True, color, thickness)
+    
+    def _draw_detections(self, frame: Union[np.ndarray, cv2.UMat], vehicles: Dict[str, np.ndarray], violations: Dict,
+                         draw_labels: bool = True):
+        """
+        Draw detection and violation bounding boxes on the frame.
+        
+        Boxes of one color are drawn with a single cv2.polylines call on ndarrays.
+        
+        Args:
+            frame: Frame (ndarray or UMat) to draw on in place
+            vehicles: Struct-of-arrays vehicle buffer
+            violations: Dictionary of violation buffers by type
+            draw_labels: Whether to draw the text labels as well as the boxes
+        """
         # Draw vehicle detections
-        for vehicle in vehicles:
-            x1, y1, x2, y2 = vehicle['bbox']
-            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-            cv2.putText(
-                frame, 
-                f"{vehicle['class_name']} {vehicle['confidence']:.2f}",
-                (x1, y1 - 10), 
-                cv2.FONT_HERSHEY_SIMPLEX, 
-                0.5, 
-                (0, 255, 0), 
-                2
-            )
+        if count_detections(vehicles):
+            self._draw_boxes(frame, vehicles['xyxy'], (0, 255, 0), 2)
+            if draw_labels:
+                class_names = self.detector.class_names
+                for (x1, y1, _, _), cls, conf in zip(vehicles['xyxy'].tolist(), vehicles['cls'].tolist(),
+                                                     vehicles['conf'].tolist()):
+                    cv2.putText(
+                        frame, 
+                        f"{class_names[cls]} {conf:.2f}",
+                        (x1, y1 - 10), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 
+                        0.5, 
+                        (0, 255, 0), 
+                        2
+                    )
         
         # Draw violations with different colors
-        violation_colors = {
-            'no_helmet': (0, 0, 255),      # Red
-            'no_seatbelt': (255, 0, 0),    # Blue
-            'triple_riding': (0, 165, 255),# Orange
-            'wrong_way': (255, 0, 255)     # Magenta
-        }
-        
-        for violation_type, violation_list in violations.items():
-            if not violation_list:
+        for violation_type, dets in violations.items():
+            if not count_detections(dets):
                 continue
                 
-            color = violation_colors.get(violation_type, (0, 0, 0))
+            color = _VIOLATION_COLORS.get(violation_type, (0, 0, 0))
             
-            for violation in violation_list:
-                # Draw vehicle bbox for violations with vehicle context
-                bbox = violation.get('vehicle_bbox', violation['bbox'])
-                x1, y1, x2, y2 = bbox
-                
-                # Draw bounding box
-                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 3)
-                
-                # Draw label
-                label = f"{violation_type.replace('_', ' ').title()} ({violation.get('confidence', 0):.2f})"
+            # Draw vehicle bbox for violations with vehicle context
+            boxes = dets.get('vehicle_xyxy', dets['xyxy'])
+            self._draw_boxes(frame, boxes, color, 3)
+            
+            if not draw_labels:
+                continue
+            
+            name = _VIOLATION_LABELS.get(violation_type) or violation_type.replace('_', ' ').title()
+            for (x1, y1, _, _), conf in zip(boxes.tolist(), dets['conf'].tolist()):
                 cv2.putText(
                     frame, 
-                    label,
+                    f"{name} ({conf:.2f})",
                     (x1, y1 - 20), 
                     cv2.FONT_HERSHEY_SIMPLEX, 
                     0.6, 
                     color, 
                     2
                 )
-                
-                # If this is a person violation (like no-helmet), draw person bbox
-                if 'rider_bbox' in violation:
-                    rx1, ry1, rx2, ry2 = violation['rider_bbox']
-                    cv2.rectangle(frame, (rx1, ry1), (rx2, ry2), (0, 255, 255), 2)
     
     def get_status(self) -> Dict:
         """Get current status of the video processor."""
@@ -0,0 +1,108 @@
+import random
+from datetime import datetime, timedelta
+from operator import itemgetter
+
+from services.store import TimeIndexedStore
+
+BASE = datetime(2023, 5, 1, 8, 0, 0)
+
+
+def make_store(maxlen=None):
+    return TimeIndexedStore(itemgetter('timestamp'), type_key=itemgetter('type'),
+                            value_key=itemgetter('value'), maxlen=maxlen)
+
+
+def record(minutes, kind='a', value=1):
+    return {'timestamp': BASE + timedelta(minutes=minutes), 'type': kind, 'value': value}
+
+
+def brute_totals(records, start):
+    selected = [r for r in records if r['timestamp'] >= start]
+    return len(selected), sum(r['value'] for r in selected)
+
+
+def test_out_of_order_inserts_are_kept_sorted():
+    store = make_store()
+    for minutes in [30, 5, 90, 0, 61]:
+        store.append(record(minutes))
+
+    assert [r['timestamp'] for r in store] == sorted(r['timestamp'] for r in store)
+    assert len(store) == 5
+
+
+def test_between_bounds_are_inclusive():
+    store = make_store()
+    for minutes in [0, 10, 20, 30]:
+        store.append(record(minutes))
+
+    start, end = BASE + timedelta(minutes=10), BASE + timedelta(minutes=20)
+    assert [r['timestamp'] for r in store.between(start, end)] == [start, end]
+    assert [r['timestamp'] for r in store.between(start, end, reverse=True)] == [end, start]
+    assert len(list(store.between(None, start))) == 2
+    assert len(list(store.between(end, None))) == 2
+
+
+def test_count_since_includes_start():
+    store = make_store()
+    for minutes in [0, 10, 20]:
+        store.append(record(minutes))
+
+    assert store.count_since(BASE + timedelta(minutes=10)) == 2
+    assert store.count_since(BASE + timedelta(minutes=10, microseconds=1)) == 1
+    assert store.count_since(BASE + timedelta(hours=1)) == 0
+
+
+def test_maxlen_evicts_oldest_timestamp_and_updates_aggregates():
+    store = make_store(maxlen=3)
+    store.append(record(120, 'b', 5))
+    store.append(record(0, 'a', 7))
+    store.append(record(60, 'a', 3))
+    # Inserted last but not the oldest: the record at minute 0 is evicted
+    store.append(record(61, 'b', 2))
+
+    assert len(store) == 3
+    assert [r['timestamp'] for r in store] == [BASE + timedelta(minutes=m) for m in (60, 61, 120)]
+    assert dict(store.type_counts) == {'a': 1, 'b': 2}
+    assert store.totals_since(BASE) == (3, 10)
+
+
+def test_maxlen_drops_emptied_type_counts():
+    store = make_store(maxlen=1)
+    store.append(record(0, 'a'))
+    store.append(record(1, 'b'))
+
+    assert dict(store.type_counts) == {'b': 1}
+
+
+def test_totals_since_window_boundaries():
+    store = make_store()
+    records = [record(m, value=m + 1) for m in (0, 59, 60, 61, 119, 120, 185)]
+    for r in records:
+        store.append(r)
+
+    for start in [
+        BASE,                                      # exactly on an hour
+        BASE + timedelta(minutes=60),              # exactly on a later hour, on a record
+        BASE + timedelta(minutes=59, seconds=30),  # partial hour just before a boundary
+        BASE + timedelta(minutes=60, microseconds=1),
+        BASE + timedelta(minutes=186),             # after every record
+        BASE - timedelta(hours=3),                 # before every record
+    ]:
+        assert store.totals_since(start) == brute_totals(records, start), start
+
+
+def test_totals_since_matches_brute_force():
+    rng = random.Random(0)
+    store = make_store(maxlen=200)
+    records = []
+    for _ in range(500):
+        r = record(rng.uniform(0, 600), rng.choice('abc'), rng.randint(0, 20))
+        records.append(r)
+        store.append(r)
+
+    kept = sorted(records, key=itemgetter('timestamp'))[-200:]
+    assert list(store) == kept
+    for _ in range(50):
+        start = BASE + timedelta(minutes=rng.uniform(-30, 630))
+        assert store.totals_since(start) == brute_totals(kept, start)
+        assert store.count_since(start) == brute_totals(kept, start)[0]
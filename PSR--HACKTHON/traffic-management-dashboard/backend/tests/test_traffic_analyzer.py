@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from ai.detection import TrafficAnalyzer
+
+START = 1.7e9  # epoch seconds
+
+
+def polyfit_prediction(analyzer, lookahead_minutes=5):
+    """Reference prediction with np.polyfit over the analyzer's trend window."""
+    x = (np.array(analyzer._trend_t) - analyzer._trend_t[0]) / 60
+    y = np.array(analyzer._trend_y, dtype=float)
+    slope, intercept = np.polyfit(x, y, 1)
+    return max(0.0, slope * (x[-1] + lookahead_minutes) + intercept)
+
+
+def test_needs_two_points():
+    analyzer = TrafficAnalyzer()
+    assert analyzer.predict_congestion() == 0.0
+    analyzer.update_vehicle_count(7, START)
+    assert analyzer.predict_congestion() == 0.0
+
+
+def test_same_timestamp_returns_last_count():
+    analyzer = TrafficAnalyzer()
+    for count in (3, 4, 9):
+        analyzer.update_vehicle_count(count, START)
+    assert analyzer.predict_congestion() == 9
+
+
+def test_linear_trend_is_extrapolated():
+    analyzer = TrafficAnalyzer()
+    for i in range(25):
+        analyzer.update_vehicle_count(10 + 2 * i, START + 60 * i)  # +2 vehicles per minute
+    # Last point is 58 at minute 24; five minutes ahead
+    assert analyzer.predict_congestion() == pytest.approx(68)
+
+
+def test_matches_polyfit_over_sliding_window():
+    rng = np.random.default_rng(0)
+    analyzer = TrafficAnalyzer()
+    t = START
+    for i in range(500):
+        t += rng.uniform(0.1, 5.0)
+        analyzer.update_vehicle_count(int(rng.integers(0, 60)), t)
+        if i >= 1:
+            assert analyzer.predict_congestion() == pytest.approx(polyfit_prediction(analyzer), rel=1e-9, abs=1e-6)
+
+
+def test_no_drift_over_long_runs():
+    rng = np.random.default_rng(1)
+    analyzer = TrafficAnalyzer()
+    t = START
+    for _ in range(100_000):  # about 5.5 h at 5 fps
+        t += 0.2
+        analyzer.update_vehicle_count(int(rng.integers(0, 60)), t)
+
+    x = (np.array(analyzer._trend_t) - analyzer._trend_t[0]) / 60
+    y = np.array(analyzer._trend_y, dtype=float)
+    n = len(x)
+    slope = (n * analyzer._sxy - analyzer._sx * analyzer._sy) / (n * analyzer._sxx - analyzer._sx ** 2)
+    assert slope == pytest.approx(np.polyfit(x, y, 1)[0], rel=1e-9)